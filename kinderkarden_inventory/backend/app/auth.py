@@ -3,6 +3,7 @@ from datetime import datetime, timezone, timedelta
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from .models import User
@@ -17,15 +18,13 @@ if not SECRET_KEY:
     raise ValueError("SECRET_KEY environment variable not set")
 ALGORITHM = "HS256"
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Cost factor is overridable so the test suite can hash cheaply
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 def verify_password(plain_password, hashed_password):
-    result = pwd_context.verify(plain_password, hashed_password)
-    print(f"Verifying password: plain={plain_password}, hashed={hashed_password}, result={result}")
-    if not result:
-        print(f"Hash of plain password: {pwd_context.hash(plain_password)}")
-    return result
+    return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
     return pwd_context.hash(password)
@@ -33,7 +32,8 @@ def get_password_hash(password):
 async def authenticate_user(username: str, password: str, db: AsyncSession):
     result = await db.execute(select(User).where(User.username == username))
     user = result.scalars().first()
-    if not user or not verify_password(password, user.password_hash):
+    # bcrypt is CPU-bound; keep it off the event loop
+    if not user or not await run_in_threadpool(verify_password, password, user.password_hash):
         return None
     return user
 
@@ -64,4 +64,25 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession
     user = result.scalars().first()
     if user is None:
         raise credentials_exception
-    return user
\ No newline at end of file
+    return user
+
+def require_roles(*roles: str):
+    # Authorizes from the token's role claim alone, so gated endpoints skip the user SELECT
+    allowed = frozenset(roles)
+
+    async def dependency(token: str = Depends(oauth2_scheme)) -> dict:
+        credentials_exception = HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            raise credentials_exception
+        if payload.get("sub") is None or payload.get("role") is None:
+            raise credentials_exception
+        if payload["role"] not in allowed:
+            raise HTTPException(status_code=403, detail="Not authorized")
+        return payload
+    return dependency
\ No newline at end of file
@@ -4,7 +4,10 @@ import os
 
 load_dotenv()
 
-celery_app = Celery('tasks', broker='redis://redis:6379/0', backend='redis://redis:6379/0')
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
+CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://redis:6379/0")
+
+celery_app = Celery('tasks', broker=CELERY_BROKER_URL, backend=CELERY_RESULT_BACKEND, include=['app.tasks'])
 
 
 celery_app.conf.update(
@@ -14,6 +17,15 @@ celery_app.conf.update(
     timezone='UTC',
     enable_utc=True,
     broker_connection_retry_on_startup=True,
-    task_always_eager=True,
+    # Eager mode runs tasks inside the caller (tests only); workers do the real work
+    task_always_eager=os.getenv("CELERY_EAGER", "0") == "1",
     task_eager_propagates=True,
-)
\ No newline at end of file
+    # Periodic jobs; run the worker with -B (see docker-compose.yml)
+    beat_schedule={
+        "refresh-portion-estimates": {
+            "task": "tasks.refresh_portion_estimates",
+            "schedule": 300.0,
+        },
+    },
+)
+
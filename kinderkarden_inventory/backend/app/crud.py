@@ -1,25 +1,26 @@
-from datetime import datetime
 from fastapi import HTTPException
-from sqlalchemy import select
+from sqlalchemy import DateTime, Integer, String, delete, func, insert, literal, select, text
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.engine import Connection
 from math import floor
+from typing import Optional
+import logging
 import redis.asyncio as redis
 
 from app.models import (
-    Product, Meal, MealIngredient, MealServing, InventoryLog
+    Product, Meal, MealIngredient, MealServing, InventoryLog, portion_estimates_mv
 )
-from app.schemas import ProductCreate, MealCreate, MealServingCreate
+from app.schemas.inventory import ProductCreate
+from app.schemas.meals import MealCreate, MealServingCreate, PortionEstimate
+from app.utils import INVENTORY_CACHE_KEYS, utcnow
+
+logger = logging.getLogger(__name__)
 
 
 async def create_product(db: AsyncSession, product: ProductCreate):
-    # Build new Product with naive UTC timestamp
-    db_product = Product(
-        name=product.name,
-        quantity=product.quantity,
-        threshold=product.threshold,
-        delivery_date=datetime.utcnow(),
-    )
+    # delivery_date falls back to the column's server default
+    db_product = Product(**product.dict(exclude_none=True))
     db.add(db_product)
     # Flush to get ID, then log
     await db.flush()
@@ -27,7 +28,7 @@ async def create_product(db: AsyncSession, product: ProductCreate):
         product_id=db_product.id,
         change_type="delivery",
         quantity=product.quantity,
-        timestamp=datetime.utcnow(),
+        timestamp=utcnow(),
         user_id=1,
     ))
     # Commit once, catch duplicate-name
@@ -48,59 +49,72 @@ async def get_product(db: AsyncSession, product_id: int):
 
 
 async def update_product(db: AsyncSession, product_id: int, product: ProductCreate):
+    # The row is needed anyway: the inventory log records the quantity delta
     result = await db.execute(select(Product).where(Product.id == product_id))
     db_product = result.scalars().first()
     if not db_product:
         return None
     old_quantity = db_product.quantity
-    for key, value in product.dict().items():
+    for key, value in product.dict(exclude_none=True).items():
         setattr(db_product, key, value)
     if old_quantity != db_product.quantity:
         db.add(InventoryLog(
             product_id=product_id,
             change_type="delivery" if db_product.quantity > old_quantity else "adjustment",
             quantity=abs(db_product.quantity - old_quantity),
-            timestamp=datetime.utcnow(),
+            timestamp=utcnow(),
             user_id=1
         ))
+    # expire_on_commit=False keeps the attributes loaded, no refresh SELECT needed
     await db.commit()
-    await db.refresh(db_product)
     return db_product
 
 
 async def delete_product(db: AsyncSession, product_id: int):
-    result = await db.execute(select(Product).where(Product.id == product_id))
-    db_product = result.scalars().first()
-    if not db_product:
+    # log removal with timestamp straight from the row: INSERT ... SELECT
+    # ... RETURNING, empty result means 404. The log is written while the
+    # product still exists; the delete then detaches it and older logs via
+    # ON DELETE SET NULL. Two round-trips, no separate SELECT.
+    result = await db.execute(
+        insert(InventoryLog)
+        .from_select(
+            ["product_id", "change_type", "quantity", "timestamp", "user_id"],
+            select(
+                Product.id,
+                literal("removal", String),
+                Product.quantity,
+                literal(utcnow(), DateTime),
+                literal(1, Integer),
+            )
+            .where(Product.id == product_id)
+            .with_for_update(),
+        )
+        .returning(InventoryLog.product_id, InventoryLog.quantity)
+    )
+    removed = result.first()
+    if not removed:
         return None
-    # log removal with timestamp
-    db.add(InventoryLog(
-        product_id=product_id,
-        change_type="removal",
-        quantity=db_product.quantity,
-        timestamp=datetime.utcnow(),
-        user_id=1
-    ))
-    db.delete(db_product)
+    await db.execute(delete(Product).where(Product.id == product_id))
     await db.commit()
-    return db_product
+    return removed
 
 
 async def create_meal(db: AsyncSession, meal: MealCreate):
+    # Validate all referenced products in one query
+    ids = {ingredient.product_id for ingredient in meal.ingredients}
+    result = await db.execute(select(Product.id).where(Product.id.in_(ids)))
+    missing = ids - set(result.scalars().all())
+    if missing:
+        raise HTTPException(status_code=422, detail=f"Products with ids {sorted(missing)} not found")
     db_meal = Meal(name=meal.name)
     db.add(db_meal)
-    await db.commit()
-    await db.refresh(db_meal)
-    for ingredient in meal.ingredients:
-        result = await db.execute(select(Product).where(Product.id == ingredient.product_id))
-        product = result.scalars().first()
-        if not product:
-            raise HTTPException(status_code=422, detail=f"Product with id {ingredient.product_id} not found")
-        db.add(MealIngredient(
-            meal_id=db_meal.id,
-            product_id=ingredient.product_id,
-            quantity=ingredient.quantity
-        ))
+    # Flush to get ID, then insert ingredients in one executemany
+    await db.flush()
+    if meal.ingredients:
+        await db.execute(insert(MealIngredient), [
+            {"meal_id": db_meal.id, "product_id": ingredient.product_id, "quantity": ingredient.quantity}
+            for ingredient in meal.ingredients
+        ])
     await db.commit()
     return db_meal
 
@@ -117,15 +131,12 @@ async def update_meal(db: AsyncSession, meal_id: int, meal: MealCreate):
         return None
     db_meal.name = meal.name
     # remove old ingredients
-    await db.execute(
-        select(MealIngredient).where(MealIngredient.meal_id == meal_id).delete()
-    )
-    for ingredient in meal.ingredients:
-        db.add(MealIngredient(
-            meal_id=meal_id,
-            product_id=ingredient.product_id,
-            quantity=ingredient.quantity
-        ))
+    await db.execute(delete(MealIngredient).where(MealIngredient.meal_id == meal_id))
+    if meal.ingredients:
+        await db.execute(insert(MealIngredient), [
+            {"meal_id": meal_id, "product_id": ingredient.product_id, "quantity": ingredient.quantity}
+            for ingredient in meal.ingredients
+        ])
     await db.commit()
     await db.refresh(db_meal)
     return db_meal
@@ -140,62 +151,106 @@ async def delete_meal(db: AsyncSession, meal_id: int):
     r = await db.execute(select(MealServing).where(MealServing.meal_id == meal_id))
     if r.scalars().first():
         raise HTTPException(status_code=400, detail="Cannot delete meal with existing servings")
-    await db.execute(
-        select(MealIngredient).where(MealIngredient.meal_id == meal_id).delete()
-    )
-    db.delete(db_meal)
+    await db.execute(delete(MealIngredient).where(MealIngredient.meal_id == meal_id))
+    await db.delete(db_meal)
     await db.commit()
     return db_meal
 
 
-async def serve_meal(db: AsyncSession, meal_serving: MealServingCreate, user_id: int):
+async def serve_meal(db: AsyncSession, meal_serving: MealServingCreate, user_id: int, redis_client: redis.Redis):
     r = await db.execute(select(MealIngredient).where(MealIngredient.meal_id == meal_serving.meal_id))
     ingredients = r.scalars().all()
     if not ingredients:
         raise HTTPException(status_code=404, detail="Meal has no ingredients defined")
 
-    redis_client = await redis.from_url("redis://redis:6379/0", encoding="utf-8", decode_responses=True)
+    # Load and lock every stock row in one query, in id order so concurrent
+    # servings of overlapping meals take their locks in the same order
+    ids = [ingredient.product_id for ingredient in ingredients]
+    res = await db.execute(select(Product).where(Product.id.in_(ids)).order_by(Product.id).with_for_update())
+    products = {p.id: p for p in res.scalars()}
+    for ingredient in ingredients:
+        product = products.get(ingredient.product_id)
+        if not product or product.quantity < ingredient.quantity:
+            raise HTTPException(status_code=400, detail=f"Insufficient quantity for {product.name if product else 'product'}")
+
+    now = utcnow()
+    for ingredient in ingredients:
+        products[ingredient.product_id].quantity -= ingredient.quantity
+    # One executemany INSERT for all consumption logs
+    await db.execute(insert(InventoryLog), [
+        {
+            "product_id": ingredient.product_id,
+            "change_type": "consumption",
+            "quantity": ingredient.quantity,
+            "timestamp": now,
+            "user_id": user_id,
+        }
+        for ingredient in ingredients
+    ])
+
+    serving = MealServing(meal_id=meal_serving.meal_id, user_id=user_id, timestamp=now)
+    db.add(serving)
+    await db.commit()
+    await db.refresh(serving)
+
+    # Publish all updates and drop stale caches in one pipelined round-trip, only after the commit.
+    # The serving is already committed: a Redis failure must not turn it into a 500
     try:
-        for ingredient in ingredients:
-            res = await db.execute(select(Product).where(Product.id == ingredient.product_id))
-            product = res.scalars().first()
-            if not product or product.quantity < ingredient.quantity:
-                raise HTTPException(status_code=400, detail=f"Insufficient quantity for {product.name if product else 'product'}")
-            product.quantity -= ingredient.quantity
-            db.add(InventoryLog(
-                product_id=ingredient.product_id,
-                change_type="consumption",
-                quantity=ingredient.quantity,
-                timestamp=datetime.utcnow(),
-                user_id=user_id
-            ))
-            await redis_client.publish("inventory_updates", f"Inventory updated: {ingredient.quantity}g of {ingredient.product_id}")
-
-        serving = MealServing(meal_id=meal_serving.meal_id, user_id=user_id, timestamp=datetime.utcnow(), )
-        db.add(serving)
-        await db.commit()
-        await db.refresh(serving)
-        return serving
-    finally:
-        await redis_client.aclose()
-
-
-async def get_portion_estimates(db: AsyncSession):
-    result = await db.execute(select(Meal))
-    meals = result.scalars().all()
-    estimates = []
-    for meal in meals:
-        r2 = await db.execute(select(MealIngredient).where(MealIngredient.meal_id == meal.id))
-        ingredients = r2.scalars().all()
-        if not ingredients:
-            estimates.append({"meal_id": meal.id, "name": meal.name, "portions": 0})
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for ingredient in ingredients:
+                pipe.publish("inventory_updates", f"Inventory updated: {ingredient.quantity}g of {ingredient.product_id}")
+            pipe.delete(*INVENTORY_CACHE_KEYS)
+            await pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Serving {serving.id} committed but Redis notify failed: {e}")
+    return serving
+
+
+async def get_portion_estimates(db: AsyncSession, skip: int = 0, limit: Optional[int] = None):
+    # Page over meals first so LIMIT counts meals, not joined ingredient rows
+    meals = select(Meal.id, Meal.name).order_by(Meal.id).offset(skip)
+    if limit is not None:
+        meals = meals.limit(limit)
+    meals = meals.subquery()
+    # One round-trip: meals LEFT JOIN ingredients LEFT JOIN products
+    stmt = (
+        select(
+            meals.c.id,
+            meals.c.name,
+            MealIngredient.product_id,
+            MealIngredient.quantity.label("need"),
+            Product.quantity.label("avail"),
+        )
+        .select_from(meals)
+        .outerjoin(MealIngredient, MealIngredient.meal_id == meals.c.id)
+        .outerjoin(Product, Product.id == MealIngredient.product_id)
+        .order_by(meals.c.id)
+    )
+    result = await db.execute(stmt)
+    portions = {}
+    names = {}
+    for meal_id, name, product_id, need, avail in result.all():
+        names[meal_id] = name
+        portions.setdefault(meal_id, None)
+        # meal without ingredients, or ingredient whose product is gone
+        if product_id is None or avail is None:
             continue
-        portions = float("inf")
-        for ingredient in ingredients:
-            r3 = await db.execute(select(Product).where(Product.id == ingredient.product_id))
-            product = r3.scalars().first()
-            if product:
-                avail = floor(product.quantity / ingredient.quantity) if ingredient.quantity > 0 else 0
-                portions = min(portions, avail)
-        estimates.append({"meal_id": meal.id, "name": meal.name, "portions": int(portions)})
-    return estimates
+        avail_portions = floor(avail / need) if need > 0 else 0
+        current = portions[meal_id]
+        portions[meal_id] = avail_portions if current is None else min(current, avail_portions)
+    # Values come straight from the database and are already typed: skip validation
+    return [
+        PortionEstimate.model_construct(meal_id=meal_id, name=names[meal_id], portions=int(p or 0))
+        for meal_id, p in portions.items()
+    ]
+
+
+def get_total_potential_portions(db: Connection):
+    # Sync: called from Celery tasks. Reads the precomputed per-meal portions
+    return db.scalar(select(func.coalesce(func.sum(portion_estimates_mv.c.portions), 0)))
+
+
+def refresh_portion_estimates(db: Connection):
+    # CONCURRENTLY keeps the view readable while it is rebuilt
+    db.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY portion_estimates_mv"))
+    db.commit()
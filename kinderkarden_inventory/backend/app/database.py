@@ -2,6 +2,7 @@ from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 from sqlalchemy import create_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from dotenv import load_dotenv
 import os
 
@@ -10,11 +11,39 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable not set")
 
+# Statement logging is opt-in: formatting every query is costly on the hot path
+SQL_ECHO = os.getenv("SQL_ECHO") == "1"
+
+# asyncpg: keep prepared statements cached per connection and skip
+# Postgres JIT compilation, which only costs time on small OLTP queries
+async_connect_args = {}
+if DATABASE_URL.startswith("postgresql+asyncpg"):
+    async_connect_args = {
+        "statement_cache_size": 1024,
+        "prepared_statement_cache_size": 500,
+        "server_settings": {"jit": "off"},
+    }
+
 # Async engine for FastAPI
-engine = create_async_engine(DATABASE_URL, echo=True)
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=SQL_ECHO,
+    connect_args=async_connect_args,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=20,
+    max_overflow=20,
+    pool_recycle=3600,
+    pool_pre_ping=True,
+)
 
 # Sync engine for Celery
-sync_engine = create_engine(DATABASE_URL.replace("postgresql+asyncpg", "postgresql+psycopg2"), echo=True)
+sync_engine = create_engine(
+    DATABASE_URL.replace("postgresql+asyncpg", "postgresql+psycopg2"),
+    echo=SQL_ECHO,
+    pool_size=20,
+    max_overflow=10,
+    pool_pre_ping=True,
+)
 
 # Async session factory
 # Async session factory
@@ -31,6 +60,7 @@ sync_session_factory = sessionmaker(
     autocommit=False,
     autoflush=False,
     bind=sync_engine,
+    expire_on_commit=False,
 )
 
 # Declarative base class
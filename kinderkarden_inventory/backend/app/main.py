@@ -5,12 +5,13 @@ warnings.filterwarnings(
     category=DeprecationWarning,
     module="passlib.utils"
 )
-from sqlalchemy.orm import selectinload
 import logging
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Response, status
+from fastapi.requests import HTTPConnection
 from fastapi import WebSocket, WebSocketDisconnect
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from jose import jwt, JWTError
 from contextlib import asynccontextmanager
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -20,6 +21,7 @@ from app.auth import (
     get_password_hash,
     create_access_token,
     get_current_user,
+    require_roles,
     authenticate_user,
     pwd_context,
 )
@@ -45,17 +47,30 @@ from app.schemas import (
     MealServingCreate,
     MealServingSchema,
     PortionEstimate,
-    VALID_ROLES,
+    ProductListAdapter,
+    MealListAdapter,
+    PortionEstimateListAdapter,
 )
 from app.database import init_db, get_db
+from celery import chord
 from celery.result import AsyncResult
-from sqlalchemy import select
+from sqlalchemy import Date, func, select
 from typing import Optional, List
 from datetime import timedelta, datetime, timezone
 from dotenv import load_dotenv
 import redis.asyncio as redis
+import json
 import os
 from app.celery_app import celery_app
+from app.utils import (
+    LOW_INVENTORY_CACHE_KEY,
+    PORTION_ESTIMATES_CACHE_KEY,
+    cache_get,
+    cache_get_json,
+    cache_set,
+    cache_set_json,
+    invalidate_inventory_cache,
+)
 from starlette.testclient import WebSocketTestSession
 from starlette.websockets import WebSocketState
 
@@ -74,15 +89,36 @@ JWT_SECRET = os.getenv("JWT_SECRET")
 if JWT_SECRET is None:
     raise ValueError("JWT_SECRET environment variable not set")
 
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# roles allowed on the /ws/inventory feed
+INVENTORY_WS_ROLES = frozenset({"admin", "manager"})
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # run your init_db at startup
     await init_db()
+    # one pooled redis client shared by every request; a blocking pool waits
+    # for a free connection instead of raising "Too many connections"
+    app.state.redis = redis.Redis(
+        connection_pool=redis.BlockingConnectionPool.from_url(
+            REDIS_URL, encoding="utf-8", decode_responses=True, max_connections=32, timeout=5
+        )
+    )
+    # websocket subscribers each pin a connection for their whole lifetime,
+    # so they get their own pool and can never starve request traffic
+    app.state.redis_pubsub = redis.from_url(REDIS_URL, encoding="utf-8", decode_responses=True)
     yield
-    # nothing special on shutdown
+    await app.state.redis_pubsub.aclose()
+    await app.state.redis.aclose()
+
+async def get_redis(connection: HTTPConnection) -> redis.Redis:
+    return connection.app.state.redis
+
+async def get_pubsub_redis(connection: HTTPConnection) -> redis.Redis:
+    return connection.app.state.redis_pubsub
 
 app = FastAPI(lifespan=lifespan)
 app.add_middleware(
@@ -107,11 +143,7 @@ async def register(
     db_user = db_user.scalars().first()
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
-    if form_data.role not in VALID_ROLES:
-        raise HTTPException(
-            status_code=400, detail=f"Invalid role. Must be one of {VALID_ROLES}"
-        )
-    hashed_password = pwd_context.hash(form_data.password)
+    hashed_password = await run_in_threadpool(pwd_context.hash, form_data.password)
     new_user = User(
         username=form_data.username,
         password_hash=hashed_password,
@@ -136,7 +168,8 @@ async def login(
         )
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, "role": user.role, "uid": user.id},
+        expires_delta=access_token_expires,
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -144,7 +177,12 @@ async def login(
 async def refresh_token(current_user: User = Depends(get_current_user)):
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": current_user.username}, expires_delta=access_token_expires
+        data={
+            "sub": current_user.username,
+            "role": current_user.role,
+            "uid": current_user.id,
+        },
+        expires_delta=access_token_expires,
     )
     return {
         "access_token": access_token,
@@ -157,22 +195,31 @@ async def get_products(
     skip: int = 0,
     limit: int = 10,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    claims: dict = Depends(require_roles("admin", "manager")),
 ):
-    if current_user.role not in ["admin", "manager"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
-    result = await db.execute(select(Product).offset(skip).limit(limit))
-    return result.scalars().all()
+    result = await db.execute(
+        select(
+            Product.id,
+            Product.name,
+            Product.quantity,
+            Product.threshold,
+            Product.delivery_date,
+        ).offset(skip).limit(limit)
+    )
+    products = ProductListAdapter.validate_python(result.mappings().all())
+    # Serialize in pydantic-core and skip FastAPI's second validation pass
+    return Response(ProductListAdapter.dump_json(products), media_type="application/json")
 
 @app.post("/products", response_model=ProductSchema)
 async def create_new_product(
     product: ProductCreate,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    redis_client: redis.Redis = Depends(get_redis),
+    claims: dict = Depends(require_roles("admin", "manager")),
 ):
-    if current_user.role not in ["admin", "manager"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
-    return await create_product(db, product)
+    new_product = await create_product(db, product)
+    await invalidate_inventory_cache(redis_client)
+    return new_product
 
 @app.get("/products/{product_id}", response_model=ProductSchema)
 async def read_product(
@@ -190,26 +237,26 @@ async def update_existing_product(
     product_id: int,
     product: ProductCreate,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    redis_client: redis.Redis = Depends(get_redis),
+    claims: dict = Depends(require_roles("admin", "manager")),
 ):
-    if current_user.role not in ["admin", "manager"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
     updated_product = await update_product(db, product_id, product)
     if not updated_product:
         raise HTTPException(status_code=404, detail="Product not found")
+    await invalidate_inventory_cache(redis_client)
     return updated_product
 
 @app.delete("/products/{product_id}")
 async def delete_existing_product(
     product_id: int,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    redis_client: redis.Redis = Depends(get_redis),
+    claims: dict = Depends(require_roles("admin", "manager")),
 ):
-    if current_user.role not in ["admin", "manager"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
     product = await delete_product(db, product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
+    await invalidate_inventory_cache(redis_client)
     return {"message": "Product deleted"}
 
 @app.get("/meals", response_model=List[MealSchema])
@@ -217,22 +264,22 @@ async def get_meals(
     skip: int = 0,
     limit: int = 10,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    claims: dict = Depends(require_roles("admin", "manager")),
 ):
-    if current_user.role not in ["admin", "manager"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
-    result = await db.execute(select(Meal).offset(skip).limit(limit))
-    return result.scalars().all()
+    result = await db.execute(select(Meal.id, Meal.name).offset(skip).limit(limit))
+    meals = MealListAdapter.validate_python(result.mappings().all())
+    return Response(MealListAdapter.dump_json(meals), media_type="application/json")
 
 @app.post("/meals", response_model=MealSchema)
 async def create_new_meal(
     meal: MealCreate,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    redis_client: redis.Redis = Depends(get_redis),
+    claims: dict = Depends(require_roles("admin", "manager")),
 ):
-    if current_user.role not in ["admin", "manager"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
-    return await create_meal(db, meal)
+    new_meal = await create_meal(db, meal)
+    await invalidate_inventory_cache(redis_client)
+    return new_meal
 
 @app.get("/meals/{meal_id}", response_model=MealSchema)
 async def read_meal(
@@ -250,82 +297,91 @@ async def update_existing_meal(
     meal_id: int,
     meal: MealCreate,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    redis_client: redis.Redis = Depends(get_redis),
+    claims: dict = Depends(require_roles("admin", "manager")),
 ):
-    if current_user.role not in ["admin", "manager"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
     updated_meal = await update_meal(db, meal_id, meal)
     if not updated_meal:
         raise HTTPException(status_code=404, detail="Meal not found")
+    await invalidate_inventory_cache(redis_client)
     return updated_meal
 
 @app.delete("/meals/{meal_id}")
 async def delete_existing_meal(
     meal_id: int,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    redis_client: redis.Redis = Depends(get_redis),
+    claims: dict = Depends(require_roles("admin", "manager")),
 ):
-    if current_user.role not in ["admin", "manager"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
     meal = await delete_meal(db, meal_id)
     if not meal:
         raise HTTPException(status_code=404, detail="Meal not found")
+    await invalidate_inventory_cache(redis_client)
     return {"message": "Meal deleted"}
 
 @app.post("/serve-meal", response_model=MealServingSchema)
 async def serve_meal_endpoint(
     meal_serving: MealServingCreate,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    redis_client: redis.Redis = Depends(get_redis),
+    claims: dict = Depends(require_roles("admin", "cook")),
 ):
-    if current_user.role not in ["admin", "cook"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
-    return await serve_meal(db, meal_serving, current_user.id)
+    return await serve_meal(db, meal_serving, claims["uid"], redis_client)
 
 @app.get("/portion-estimates", response_model=List[PortionEstimate])
 async def get_portion_estimates_endpoint(
+    skip: int = 0,
+    limit: int = 50,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    redis_client: redis.Redis = Depends(get_redis),
+    claims: dict = Depends(require_roles("admin", "manager")),
 ):
-    if current_user.role not in ["admin", "manager"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
-    return await get_portion_estimates(db)
+    page = f"{skip}:{limit}"
+    # Cached pages are stored as response JSON and sent back untouched
+    body = await cache_get(redis_client, PORTION_ESTIMATES_CACHE_KEY, field=page)
+    if body is None:
+        estimates = await get_portion_estimates(db, skip, limit)
+        body = PortionEstimateListAdapter.dump_json(estimates)
+        await cache_set(redis_client, PORTION_ESTIMATES_CACHE_KEY, body, field=page)
+    return Response(body, media_type="application/json")
 
 @app.post("/generate-report")
 async def generate_report(
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    claims: dict = Depends(require_roles("admin", "manager")),
 ):
-    if current_user.role not in ["admin", "manager"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
-    task = celery_app.send_task("tasks.generate_monthly_report")
-    logger.info(f"Started generate_monthly_report task with ID: {task.id}")
+    # Both aggregates run in parallel on separate workers; the callback merges them
+    task = chord([
+        celery_app.signature("tasks.generate_monthly_report"),
+        celery_app.signature("tasks.calculate_discrepancy_rate", kwargs={"tolerate_errors": True}),
+    ])(celery_app.signature("tasks.combine_monthly_report"))
+    logger.info(f"Started monthly report chord with ID: {task.id}")
     return {"task_id": task.id, "status": "Report generation started"}
 
 @app.get("/notifications")
 async def get_notifications(
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    redis_client: redis.Redis = Depends(get_redis),
+    claims: dict = Depends(require_roles("admin", "manager")),
 ):
-    if current_user.role not in ["admin", "manager"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
-    result = await db.execute(select(Product).where(Product.quantity < Product.threshold))
-    low_inventory = result.scalars().all()
-    task = celery_app.send_task("tasks.calculate_discrepancy_rate")
-    return {
-        "low_inventory": [
+    low_inventory = await cache_get_json(redis_client, LOW_INVENTORY_CACHE_KEY)
+    if low_inventory is None:
+        result = await db.execute(select(Product).where(Product.quantity < Product.threshold))
+        low_inventory = [
             {"id": p.id, "name": p.name, "quantity": p.quantity}
-            for p in low_inventory
-        ],
+            for p in result.scalars().all()
+        ]
+        await cache_set_json(redis_client, LOW_INVENTORY_CACHE_KEY, low_inventory)
+    task = celery_app.signature("tasks.calculate_discrepancy_rate").delay()
+    return {
+        "low_inventory": low_inventory,
         "discrepancy_task_id": task.id,
     }
 
 @app.get("/discrepancy/{task_id}")
 async def get_discrepancy(
-    task_id: str, current_user: User = Depends(get_current_user)
+    task_id: str, claims: dict = Depends(require_roles("admin", "manager"))
 ):
-    if current_user.role not in ["admin", "manager"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
     task_result = celery_app.AsyncResult(task_id)
     state = getattr(task_result, "state", getattr(task_result, "status", None))
     logger.info(f"Checking discrepancy task {task_id}, state: {state}")
@@ -340,10 +396,8 @@ async def get_discrepancy(
 
 @app.get("/report/{task_id}")
 async def get_report(
-    task_id: str, current_user: User = Depends(get_current_user)
+    task_id: str, claims: dict = Depends(require_roles("admin", "manager"))
 ):
-    if current_user.role not in ["admin", "manager"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
     task_result = celery_app.AsyncResult(task_id)
     state = getattr(task_result, "state", getattr(task_result, "status", None))
     logger.info(f"Checking report task {task_id}, state: {state}")
@@ -361,10 +415,8 @@ async def get_usage_report(
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    claims: dict = Depends(require_roles("admin", "manager")),
 ):
-    if current_user.role not in ["admin", "manager"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
     if start_date:
         # ensure it's in UTC and then drop tzinfo
         start_date = start_date.astimezone(timezone.utc).replace(tzinfo=None)
@@ -372,20 +424,17 @@ async def get_usage_report(
         end_date = end_date.astimezone(timezone.utc).replace(tzinfo=None)
         # ──────────────────────────────────────────────
 
-    query = select(InventoryLog)
+    # Sum per day in the database; only one row per day crosses the wire
+    day = func.date(InventoryLog.timestamp, type_=Date).label("day")
+    query = select(day, func.sum(InventoryLog.quantity))
     if start_date:
         query = query.where(InventoryLog.timestamp >= start_date)
     if end_date:
         query = query.where(InventoryLog.timestamp <= end_date)
+    query = query.group_by(day)
 
     result = await db.execute(query)
-
-
-    logs = result.scalars().all()
-    usage_data = {}
-    for log in logs:
-        date = log.timestamp.date().isoformat()
-        usage_data[date] = usage_data.get(date, 0) + log.quantity
+    usage_data = {d.isoformat(): total for d, total in result.all()}
     return {"usage": usage_data}
 # main.py
 
@@ -401,15 +450,13 @@ async def get_servings_log(
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    claims: dict = Depends(require_roles("admin", "manager")),
 ):
-    if current_user.role not in ["admin", "manager"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
 
-    # 1️⃣ Use selectinload(MealServing.user) to eager-load the 'user' relationship:
+    # Single JOIN projected to the three columns we return; no ORM hydration
     query = (
-        select(MealServing)
-        .options(selectinload(MealServing.user))
+        select(MealServing.meal_id, User.username, MealServing.timestamp)
+        .join(User, User.id == MealServing.user_id)
     )
 
     if start_date:
@@ -419,18 +466,18 @@ async def get_servings_log(
 
     query = query.offset(skip).limit(limit)
     result = await db.execute(query)
-    servings = result.scalars().all()
-
-    # Now s.user is already loaded, so .username won’t trigger a lazy-load
     return [
-        {"meal_id": s.meal_id, "user": s.user.username, "timestamp": s.timestamp}
-        for s in servings
+        {"meal_id": meal_id, "user": username, "timestamp": timestamp}
+        for meal_id, username, timestamp in result.all()
     ]
 
 
 @app.websocket("/ws/inventory")
 async def websocket_inventory(
-    websocket: WebSocket, token: str, db: AsyncSession = Depends(get_db)
+    websocket: WebSocket,
+    token: str,
+    db: AsyncSession = Depends(get_db),
+    redis_client: redis.Redis = Depends(get_pubsub_redis),
 ):
     try:
         if JWT_SECRET is None:
@@ -449,28 +496,27 @@ async def websocket_inventory(
 
         result = await db.execute(select(User).where(User.username == username))
         user = result.scalars().first()
-        if not user or user.role not in ["admin", "manager"]:
+        if not user or user.role not in INVENTORY_WS_ROLES:
             await websocket.close(code=1008, reason="Not authorized")
             return
 
-        await websocket.accept()
-        redis_client = await redis.from_url(
-            "redis://redis:6379/0", encoding="utf-8", decode_responses=True
-        )
+        # subscribe before the handshake completes, so no update published
+        # after the client sees the socket open is missed
         pubsub = redis_client.pubsub()
         await pubsub.subscribe("inventory_updates")
+        await websocket.accept()
 
         try:
+            # channel is fixed, so encode it once and splice each payload in
+            prefix = f'{{"channel":{json.dumps("inventory_updates")},"data":'
             async for message in pubsub.listen():
                 if message["type"] == "message":
-                    await websocket.send_json(
-                        {"channel": message["channel"], "data": message["data"]}
-                    )
+                    await websocket.send_text(f'{prefix}{json.dumps(message["data"])}}}')
         except WebSocketDisconnect:
             logger.info(f"WebSocket disconnected for user {user.username}")
         finally:
             await pubsub.unsubscribe("inventory_updates")
-            await redis_client.aclose()
+            await pubsub.aclose()
     except Exception as e:
         logger.error(f"WebSocket setup error: {e}")
         await websocket.close(code=1011, reason="Internal error")
@@ -1,10 +1,32 @@
 # app/models.py
 
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import DDL, Column, Integer, String, Float, DateTime, ForeignKey, Index, column, event, table, text
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import relationship
+from sqlalchemy.sql.expression import FunctionElement
 from datetime import datetime
 from .database import Base
 
+
+class utc_timestamp(FunctionElement):
+    """Current UTC time as a naive timestamp, for server-side defaults.
+
+    now() on a naive column stores the server's local time instead.
+    """
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(utc_timestamp, "postgresql")
+def _pg_utc_timestamp(element, compiler, **kw):
+    return "timezone('utc', now())"
+
+
+@compiles(utc_timestamp)
+def _utc_timestamp(element, compiler, **kw):
+    # SQLite's CURRENT_TIMESTAMP is already UTC
+    return "CURRENT_TIMESTAMP"
+
 class User(Base):
     __tablename__ = "users"
     id            = Column(Integer, primary_key=True, index=True)
@@ -17,9 +39,14 @@ class Product(Base):
     id            = Column(Integer, primary_key=True, index=True)
     name          = Column(String, unique=True, nullable=False)
     quantity      = Column(Float, nullable=False)
-    delivery_date = Column(DateTime, default=datetime.utcnow)
+    delivery_date = Column(DateTime, server_default=utc_timestamp(), nullable=False)
     threshold     = Column(Float, nullable=False)
 
+    __table_args__ = (
+        # partial index backing the low-stock /notifications scan
+        Index("ix_products_low_stock", "quantity", postgresql_where=text("quantity < threshold")),
+    )
+
 class Meal(Base):
     __tablename__ = "meals"
     id       = Column(Integer, primary_key=True, index=True)
@@ -37,7 +64,7 @@ class MealServing(Base):
     id        = Column(Integer, primary_key=True, index=True)
     meal_id   = Column(Integer, ForeignKey("meals.id"), nullable=False)
     user_id   = Column(Integer, ForeignKey("users.id"), nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
 
     meal = relationship("Meal", back_populates="servings")
     user = relationship("User")
@@ -45,8 +72,46 @@ class MealServing(Base):
 class InventoryLog(Base):
     __tablename__ = "inventory_logs"
     id          = Column(Integer, primary_key=True, index=True)
-    product_id  = Column(Integer, ForeignKey("products.id"), nullable=False)
+    # NULL once the product is deleted: the log history outlives the product
+    product_id  = Column(Integer, ForeignKey("products.id", ondelete="SET NULL"), nullable=True)
     change_type = Column(String, nullable=False)
     quantity    = Column(Float, nullable=False)
-    timestamp   = Column(DateTime, default=datetime.utcnow)
+    timestamp   = Column(DateTime, default=datetime.utcnow, index=True)
     user_id     = Column(Integer, ForeignKey("users.id"), nullable=False)
+
+    __table_args__ = (
+        Index("ix_inventory_logs_product_id_timestamp", "product_id", "timestamp"),
+        Index("ix_inventory_logs_change_type_timestamp", "change_type", "timestamp"),
+    )
+
+# Materialized view (see migration b81f4d2a6c35). create_all does not know about
+# views, so bootstrapping with init_db creates it through the DDL hooks below
+portion_estimates_mv = table(
+    "portion_estimates_mv",
+    column("meal_id", Integer),
+    column("name", String),
+    column("portions", Integer),
+)
+
+# Per-meal whole portions, refreshed by the refresh_portion_estimates task.
+# IF NOT EXISTS: databases built by Alembic already have it
+event.listen(Base.metadata, "after_create", DDL("""
+    CREATE MATERIALIZED VIEW IF NOT EXISTS portion_estimates_mv AS
+    SELECT m.id AS meal_id,
+           m.name,
+           COALESCE(MIN(CASE WHEN mi.quantity > 0
+                             THEN FLOOR(p.quantity / mi.quantity)
+                             ELSE 0 END), 0)::int AS portions
+    FROM meals m
+    LEFT JOIN meal_ingredients mi ON mi.meal_id = m.id
+    LEFT JOIN products p ON p.id = mi.product_id
+    GROUP BY m.id, m.name
+""").execute_if(dialect="postgresql"))
+# REFRESH ... CONCURRENTLY requires a unique index
+event.listen(Base.metadata, "after_create", DDL(
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_portion_estimates_mv_meal_id ON portion_estimates_mv (meal_id)"
+).execute_if(dialect="postgresql"))
+# The view depends on the tables, so it has to go first
+event.listen(Base.metadata, "before_drop", DDL(
+    "DROP MATERIALIZED VIEW IF EXISTS portion_estimates_mv"
+).execute_if(dialect="postgresql"))
@@ -0,0 +1,42 @@
+# Schemas are split by area and loaded on first use, so a process only
+# builds the pydantic models it actually touches
+from importlib import import_module
+
+_EXPORTS = {
+    "VALID_ROLES": "auth",
+    "Role": "auth",
+    "UserCreate": "auth",
+    "UserLogin": "auth",
+    "ProductBase": "inventory",
+    "ProductCreate": "inventory",
+    "ProductSchema": "inventory",
+    "InventoryLogBase": "inventory",
+    "InventoryLogCreate": "inventory",
+    "InventoryLog": "inventory",
+    "ProductListAdapter": "inventory",
+    "InventoryLogListAdapter": "inventory",
+    "MealBase": "meals",
+    "MealSchema": "meals",
+    "MealIngredientBase": "meals",
+    "MealIngredient": "meals",
+    "MealCreate": "meals",
+    "MealServingBase": "meals",
+    "MealServingCreate": "meals",
+    "MealServingSchema": "meals",
+    "PortionEstimate": "meals",
+    "MealListAdapter": "meals",
+    "MealServingListAdapter": "meals",
+    "PortionEstimateListAdapter": "meals",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(f"{__name__}.{module}"), name)
+    globals()[name] = value
+    return value
+
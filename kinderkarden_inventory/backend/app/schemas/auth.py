@@ -0,0 +1,16 @@
+from pydantic import BaseModel, Field
+from typing import Literal, get_args
+
+# Checked by pydantic-core, so handlers need no membership test
+Role = Literal["admin", "cook", "manager"]
+# Derived from Role so the two can never drift apart
+VALID_ROLES: frozenset[str] = frozenset(get_args(Role))
+
+class UserCreate(BaseModel):
+    username: str = Field(min_length=3, max_length=50, pattern=r'^[a-zA-Z0-9_]+$')
+    password: str = Field(min_length=6)
+    role: Role
+
+class UserLogin(BaseModel):
+    username: str
+    password: str
@@ -0,0 +1,41 @@
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter
+from datetime import datetime
+from typing import List, Optional
+
+class ProductBase(BaseModel):
+    name: str
+    quantity: float
+    threshold: float
+
+class ProductCreate(ProductBase):
+    name: str
+    quantity: float = Field(ge=0)
+    threshold: float = Field(ge=0)
+    delivery_date: Optional[datetime] = None
+
+class ProductSchema(ProductBase):
+    id: int
+    delivery_date: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+class InventoryLogBase(BaseModel):
+    product_id: int
+    change_type: str
+    quantity: float
+
+class InventoryLogCreate(InventoryLogBase):
+    pass
+
+class InventoryLog(InventoryLogBase):
+    id: int
+    # None for logs of a deleted product
+    product_id: Optional[int]
+    user_id: int
+    timestamp: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+# List adapters are built once at import and shared by the list endpoints
+ProductListAdapter = TypeAdapter(List[ProductSchema])
+InventoryLogListAdapter = TypeAdapter(List[InventoryLog])
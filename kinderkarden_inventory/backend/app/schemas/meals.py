@@ -0,0 +1,45 @@
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter
+from datetime import datetime
+from typing import List
+
+class MealBase(BaseModel):
+    name: str
+
+class MealSchema(MealBase):
+    id: int
+
+    model_config = ConfigDict(from_attributes=True)
+
+class MealIngredientBase(BaseModel):
+    meal_id: int
+    product_id: int
+    quantity: float = Field(ge=0)
+
+class MealIngredient(MealIngredientBase):
+    model_config = ConfigDict(from_attributes=True)
+
+class MealCreate(MealBase):
+    ingredients: List[MealIngredient]
+
+class MealServingBase(BaseModel):
+    meal_id: int
+
+class MealServingCreate(MealServingBase):
+    pass
+
+class MealServingSchema(MealServingBase):
+    id: int
+    user_id: int
+    timestamp: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+class PortionEstimate(BaseModel):
+    meal_id: int
+    name: str
+    portions: int
+
+# List adapters are built once at import and shared by the list endpoints
+MealListAdapter = TypeAdapter(List[MealSchema])
+MealServingListAdapter = TypeAdapter(List[MealServingSchema])
+PortionEstimateListAdapter = TypeAdapter(List[PortionEstimate])
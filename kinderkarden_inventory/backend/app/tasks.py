@@ -1,10 +1,9 @@
 from celery import shared_task
-from app.database import get_db_sync
+from app.database import sync_engine
 from app.models import InventoryLog, MealServing
-from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import func, select
 from datetime import datetime, timedelta, timezone
-from app.crud import get_portion_estimates
+from app.crud import get_total_potential_portions, refresh_portion_estimates
 from app.celery_app import celery_app
 import logging
 
@@ -13,24 +12,32 @@ logger = logging.getLogger('celery')
 @celery_app.task(name='tasks.generate_monthly_report')
 def generate_monthly_report():
     logger.info("Starting generate_monthly_report task")
-    db: Session = next(get_db_sync())
     try:
         end_date = datetime.now(timezone.utc)
         start_date = end_date - timedelta(days=30)
         logger.info(f"Querying logs from {start_date} to {end_date}")
-        logs = db.execute(
-            select(InventoryLog).where(
-                InventoryLog.timestamp >= start_date,
-                InventoryLog.timestamp <= end_date
-            )
-        ).scalars().all()
-        logger.info(f"Found {len(logs)} logs")
-        report = {"total_deliveries": 0, "total_consumption": 0}
-        for log in logs:
-            if log.change_type == "delivery":
-                report["total_deliveries"] += log.quantity
-            elif log.change_type == "consumption":
-                report["total_consumption"] += log.quantity
+        # One grouped query yields both the totals and the per-product breakdown.
+        # Core connection, plain tuples; it goes back to the pool before the reduction
+        with sync_engine.connect() as conn:
+            rows = conn.execute(
+                select(InventoryLog.product_id, InventoryLog.change_type, func.sum(InventoryLog.quantity))
+                .where(
+                    InventoryLog.timestamp >= start_date,
+                    InventoryLog.timestamp < end_date
+                )
+                .group_by(InventoryLog.product_id, InventoryLog.change_type)
+            ).all()
+        logger.info(f"Aggregated {len(rows)} product/change type groups")
+        totals = {}
+        per_product = {}
+        for product_id, change_type, quantity in rows:
+            totals[change_type] = totals.get(change_type, 0) + quantity
+            per_product.setdefault(product_id, {})[change_type] = quantity
+        report = {
+            "total_deliveries": totals.get("delivery", 0),
+            "total_consumption": totals.get("consumption", 0),
+            "per_product": per_product,
+        }
         logger.info("Task completed successfully")
         return {
             "start_date": start_date.isoformat(),
@@ -40,24 +47,21 @@ def generate_monthly_report():
     except Exception as e:
         logger.error(f"Task failed: {str(e)}")
         raise Exception(f"Failed to generate monthly report: {str(e)}")
-    finally:
-        db.close()
 
 @celery_app.task(name='tasks.calculate_discrepancy_rate')
-def calculate_discrepancy_rate():
+def calculate_discrepancy_rate(tolerate_errors=False):
     logger.info("Starting calculate_discrepancy_rate task")
-    db: Session = next(get_db_sync())
     try:
         end_date = datetime.now(timezone.utc)
         start_date = end_date - timedelta(days=30)
-        servings = db.execute(
-            select(MealServing).where(
-                MealServing.timestamp >= start_date,
-                MealServing.timestamp <= end_date
+        with sync_engine.connect() as conn:
+            servings_count = conn.scalar(
+                select(func.count(MealServing.id)).where(
+                    MealServing.timestamp >= start_date,
+                    MealServing.timestamp < end_date
+                )
             )
-        ).scalars().all()
-        servings_count = len(servings)
-        potential_portions = sum(p["portions"] for p in get_portion_estimates(db))
+            potential_portions = get_total_potential_portions(conn)
         discrepancy_rate = ((potential_portions - servings_count) / potential_portions * 100) if potential_portions > 0 else 0
         logger.info("Task completed successfully")
         return {
@@ -69,6 +73,25 @@ def calculate_discrepancy_rate():
         }
     except Exception as e:
         logger.error(f"Task failed: {str(e)}")
+        if tolerate_errors:
+            # In the report chord a failed header task would fail the whole report
+            return {"error": f"Failed to calculate discrepancy rate: {str(e)}"}
         raise Exception(f"Failed to calculate discrepancy rate: {str(e)}")
-    finally:
-        db.close()
\ No newline at end of file
+
+@celery_app.task(name='tasks.combine_monthly_report')
+def combine_monthly_report(results):
+    # Chord callback: results arrive in header order. discrepancy is
+    # {"error": ...} when it could not be computed; the report still ships
+    report, discrepancy = results
+    return {**report, "discrepancy": discrepancy}
+
+@celery_app.task(name='tasks.refresh_portion_estimates')
+def refresh_portion_estimates_task():
+    logger.info("Starting refresh_portion_estimates task")
+    try:
+        with sync_engine.connect() as conn:
+            refresh_portion_estimates(conn)
+        logger.info("Task completed successfully")
+    except Exception as e:
+        logger.error(f"Task failed: {str(e)}")
+        raise Exception(f"Failed to refresh portion estimates: {str(e)}")
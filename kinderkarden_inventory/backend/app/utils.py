@@ -0,0 +1,64 @@
+import json
+import logging
+from datetime import datetime, timezone
+
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+
+def utcnow():
+    # Naive UTC, matching the DateTime columns; replaces deprecated datetime.utcnow()
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# Short-lived Redis cache for read-heavy inventory views. The cache is never
+# the source of truth: a Redis error reads as a miss and skips the write, so
+# an outage only costs the database queries it was saving
+CACHE_TTL_SECONDS = 15
+PORTION_ESTIMATES_CACHE_KEY = "portion_estimates"
+LOW_INVENTORY_CACHE_KEY = "low_inventory"
+INVENTORY_CACHE_KEYS = (PORTION_ESTIMATES_CACHE_KEY, LOW_INVENTORY_CACHE_KEY)
+
+
+async def cache_get(redis_client, key, field=None):
+    try:
+        if field is None:
+            return await redis_client.get(key)
+        return await redis_client.hget(key, field)
+    except RedisError as e:
+        logger.warning(f"Cache read of {key} failed, falling back to the database: {e}")
+        return None
+
+
+async def cache_set(redis_client, key, value, ttl=CACHE_TTL_SECONDS, field=None):
+    try:
+        if field is None:
+            await redis_client.set(key, value, ex=ttl)
+            return
+        # Paged views share one hash so a single DELETE drops every page
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hset(key, field, value)
+            pipe.expire(key, ttl)
+            await pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Cache write of {key} failed: {e}")
+
+
+async def cache_get_json(redis_client, key, field=None):
+    cached = await cache_get(redis_client, key, field)
+    return json.loads(cached) if cached is not None else None
+
+
+async def cache_set_json(redis_client, key, data, ttl=CACHE_TTL_SECONDS, field=None):
+    await cache_set(redis_client, key, json.dumps(data), ttl, field)
+
+
+async def invalidate_inventory_cache(redis_client):
+    # Called after a commit: the write already succeeded, so a failure here
+    # must not turn into a 500 the client might retry. Stale entries expire
+    # within CACHE_TTL_SECONDS.
+    try:
+        await redis_client.delete(*INVENTORY_CACHE_KEYS)
+    except RedisError as e:
+        logger.warning(f"Inventory cache invalidation failed: {e}")
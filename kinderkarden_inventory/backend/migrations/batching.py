@@ -0,0 +1,38 @@
+"""Helpers for data migrations that touch large tables.
+
+Usage inside a revision's upgrade():
+
+    from migrations.batching import run_in_batches
+
+    logs = sa.table("inventory_logs", sa.column("id"), sa.column("quantity"))
+
+    def apply(batch):
+        op.get_bind().execute(...)
+
+    run_in_batches(logs, logs.c.id, apply)
+"""
+from alembic import op
+from sqlalchemy import select
+
+BATCH_SIZE = 100
+
+
+def paginate(connection, table, key, batch_size=BATCH_SIZE):
+    # Keyset pagination: only one batch is ever held in memory
+    last = None
+    while True:
+        stmt = select(table).order_by(key).limit(batch_size)
+        if last is not None:
+            stmt = stmt.where(key > last)
+        rows = connection.execute(stmt).all()
+        if not rows:
+            return
+        yield rows
+        last = rows[-1]._mapping[key.name]
+
+
+def run_in_batches(table, key, apply, batch_size=BATCH_SIZE):
+    # Each batch commits on its own, so locks are held per batch, not per migration
+    with op.get_context().autocommit_block():
+        for batch in paginate(op.get_bind(), table, key, batch_size):
+            apply(batch)
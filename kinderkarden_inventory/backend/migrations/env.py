@@ -60,6 +60,9 @@ def run_migrations_online() -> None:
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
+            # One transaction per revision, so a batched data migration
+            # (see migrations/batching.py) never runs inside a long one
+            transaction_per_migration=True,
         )
 
         with context.begin_transaction():
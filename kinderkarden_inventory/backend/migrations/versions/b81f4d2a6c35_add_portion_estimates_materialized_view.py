@@ -0,0 +1,44 @@
+"""Add portion_estimates_mv materialized view
+
+Revision ID: b81f4d2a6c35
+Revises: e5a8d3c6f921
+Create Date: 2025-06-05 14:12:09.482317
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b81f4d2a6c35'
+down_revision: Union[str, None] = 'e5a8d3c6f921'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Per-meal whole portions, refreshed by the refresh_portion_estimates task.
+    # IF NOT EXISTS: init_db's create_all may already have built it (see app/models.py)
+    op.execute("""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS portion_estimates_mv AS
+        SELECT m.id AS meal_id,
+               m.name,
+               COALESCE(MIN(CASE WHEN mi.quantity > 0
+                                 THEN FLOOR(p.quantity / mi.quantity)
+                                 ELSE 0 END), 0)::int AS portions
+        FROM meals m
+        LEFT JOIN meal_ingredients mi ON mi.meal_id = m.id
+        LEFT JOIN products p ON p.id = mi.product_id
+        GROUP BY m.id, m.name
+    """)
+    # REFRESH ... CONCURRENTLY requires a unique index
+    op.create_index('ix_portion_estimates_mv_meal_id', 'portion_estimates_mv', ['meal_id'], unique=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_portion_estimates_mv_meal_id', table_name='portion_estimates_mv')
+    op.execute("DROP MATERIALIZED VIEW portion_estimates_mv")
@@ -1,58 +1,33 @@
+import asyncio
 import pytest
 import pytest_asyncio
 from httpx import AsyncClient, ASGITransport
-from sqlalchemy import text, select
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
-from datetime import datetime, timedelta
+from datetime import datetime
 
 import app.main as main_module
-from app.main import app
-from app.database import Base, get_db
-from app.models import User, Product, Meal, MealIngredient, MealServing, InventoryLog
-from app.auth import get_password_hash
+from app.main import app, get_pubsub_redis, get_redis
+from app.models import Product, Meal, MealServing, InventoryLog
 from app.celery_app import celery_app
+from app.utils import PORTION_ESTIMATES_CACHE_KEY
+from redis.exceptions import ConnectionError as RedisConnectionError
 
-# --- 1) Set up in-memory SQLite and override get_db ----
-SQLALCHEMY_TEST_URL = "sqlite+aiosqlite:///:memory:"
-engine = create_async_engine(SQLALCHEMY_TEST_URL, echo=False)
-TestingSessionLocal = sessionmaker(
-    engine, class_=AsyncSession, expire_on_commit=False
-)
-
-@pytest_asyncio.fixture(scope="session", autouse=True)
-async def prepare_database():
-    # create all tables once
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    yield
-    # drop all at end
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.drop_all)
+# --- 1) Engine, schema, seed rows and db_session come from conftest ---
 
 @pytest_asyncio.fixture
-async def db_session():
-    async with TestingSessionLocal() as session:
-        yield session
-
-
-@pytest_asyncio.fixture
-async def client(db_session: AsyncSession, monkeypatch):
+async def client(monkeypatch):
      # override init_db to a no-op so our TestClient never hits the real DATABASE_URL
-     import app.main as main_module
      async def _noop_init_db():
          return
      monkeypatch.setattr(main_module, "init_db", _noop_init_db)
 
-     # override the DB dependency to use our in-memory SQLite
-     async def _get_db():
-         yield db_session
-     app.dependency_overrides[get_db] = _get_db
-
      # patch celery to synchronous dummy
      class DummyTask:
          def __init__(self, id): self.id = id
-     monkeypatch.setattr(celery_app, 'send_task', lambda name, *args, **kwargs: DummyTask(id="task-123"))
+     class DummySignature:
+         def __init__(self, name): self.name = name
+         def delay(self, *args, **kwargs): return DummyTask(id="task-123")
+     monkeypatch.setattr(celery_app, 'signature', lambda name, *args, **kwargs: DummySignature(name))
+     monkeypatch.setattr(main_module, 'chord', lambda header: lambda body: DummyTask(id="task-123"))
      class DummyResult:
          def __init__(self, result): self._result = result
          def ready(self): return True
@@ -60,87 +35,54 @@ async def client(db_session: AsyncSession, monkeypatch):
          def get(self, propagate=True): return self._result
      monkeypatch.setattr(celery_app, 'AsyncResult', lambda tid: DummyResult({"foo": "bar"}))
 
+     # in-memory stand-in for the shared redis client
+     class DummyPubSub:
+         async def subscribe(self, *channels): pass
+         async def unsubscribe(self, *channels): pass
+         async def aclose(self): pass
+         async def listen(self):
+             await asyncio.Event().wait()
+             yield
+     class DummyPipeline:
+         def __init__(self, store): self._store = store
+         async def __aenter__(self): return self
+         async def __aexit__(self, *exc): return False
+         def publish(self, channel, message): pass
+         def hset(self, key, field, value): self._store.setdefault(key, {})[field] = value
+         def expire(self, key, ttl): pass
+         def delete(self, *keys):
+             for key in keys: self._store.pop(key, None)
+         async def execute(self): return []
+     class DummyRedis:
+         def __init__(self): self.store = {}
+         async def get(self, key): return self.store.get(key)
+         async def set(self, key, value, ex=None): self.store[key] = value
+         async def hget(self, key, field): return self.store.get(key, {}).get(field)
+         async def delete(self, *keys):
+             for key in keys: self.store.pop(key, None)
+         def pipeline(self, transaction=True): return DummyPipeline(self.store)
+         def pubsub(self): return DummyPubSub()
+     dummy_redis = DummyRedis()
+     # setitem: the overrides are undone after each test, so later modules get real Redis
+     monkeypatch.setitem(app.dependency_overrides, get_redis, lambda: dummy_redis)
+     monkeypatch.setitem(app.dependency_overrides, get_pubsub_redis, lambda: dummy_redis)
+
      transport = ASGITransport(app=app)
      async with AsyncClient(transport=transport, base_url="http://test") as ac:
          yield ac
 
 
-# --- 2) Seed a clean state before each test ---
-@pytest_asyncio.fixture(autouse=True)
-async def seed_data(db_session: AsyncSession):
-    # wipe every table
-    for tbl in (
-        "meal_servings", "inventory_logs", "meal_ingredients",
-        "meals", "products", "users"
-    ):
-        await db_session.execute(text(f"DELETE FROM {tbl}"))
-    await db_session.commit()
+# --- 2) admin_token / cook_token also come from conftest ---
 
-    # create two users: admin & cook
-    admin = User(
-        username="adminuser",
-        password_hash=get_password_hash("adminpass"),
-        role="admin"
-    )
-    cook = User(
-        username="cookuser",
-        password_hash=get_password_hash("cookpass"),
-        role="cook"
-    )
-    db_session.add_all([admin, cook])
-    await db_session.commit()
+# --- 3) Comprehensive Tests ---
 
-    # one product + one meal + one ingredient
-    prod = Product(
-        name="Milk",
-        quantity=100.0,
-        threshold=10.0,
-        delivery_date=datetime.now()
-    )
-    meal = Meal(name="Breakfast")
-    db_session.add_all([prod, meal])
-    await db_session.commit()
-
-    ing = MealIngredient(
-        meal_id=meal.id,
-        product_id=prod.id,
-        quantity=50.0
-    )
-    db_session.add(ing)
-    await db_session.commit()
-
-    yield
-    await db_session.rollback()
-
-# --- 3) Helpers to grab JWT tokens ---
-@pytest_asyncio.fixture
-async def admin_token(client: AsyncClient):
-    r = await client.post(
-        "/login",
-        data={"username":"adminuser","password":"adminpass"}
-    )
-    assert r.status_code == 200
-    return r.json()["access_token"]
-
-@pytest_asyncio.fixture
-async def cook_token(client: AsyncClient):
-    r = await client.post(
-        "/login",
-        data={"username":"cookuser","password":"cookpass"}
-    )
-    assert r.status_code == 200
-    return r.json()["access_token"]
-
-# --- 4) Comprehensive Tests ---
-
-@pytest.mark.asyncio
 async def test_invalid_and_duplicate_registration(client):
     # invalid role
     r = await client.post(
         "/register",
         json={"username":"foo","password":"barbaz","role":"bogus"}
     )
-    assert r.status_code == 400
+    assert r.status_code == 422
 
     # duplicate username
     r2 = await client.post(
@@ -149,7 +91,6 @@ async def test_invalid_and_duplicate_registration(client):
     )
     assert r2.status_code == 400
 
-@pytest.mark.asyncio
 async def test_login_wrong_password(client):
     r = await client.post(
         "/login",
@@ -157,7 +98,6 @@ async def test_login_wrong_password(client):
     )
     assert r.status_code == 401
 
-@pytest.mark.asyncio
 async def test_products_crud_and_authorization(client, admin_token, cook_token):
     # admin can list & create
     r = await client.get(
@@ -175,7 +115,6 @@ async def test_products_crud_and_authorization(client, admin_token, cook_token):
     )
     assert r2.status_code == 403
 
-@pytest.mark.asyncio
 async def test_meal_delete_with_existing_serving(client, admin_token, db_session):
     # add a serving for meal id 1
     ms = MealServing(meal_id=1, user_id=1)
@@ -189,7 +128,6 @@ async def test_meal_delete_with_existing_serving(client, admin_token, db_session
     )
     assert r.status_code == 400
 
-@pytest.mark.asyncio
 async def test_portion_estimates_zero_ingredient(client, admin_token, db_session):
     # create an empty meal
     m2 = Meal(name="EmptyMeal")
@@ -206,7 +144,58 @@ async def test_portion_estimates_zero_ingredient(client, admin_token, db_session
     empty = next(x for x in data if x["meal_id"] == m2.id)
     assert empty["portions"] == 0
 
-@pytest.mark.asyncio
+async def test_portion_estimates_cache(client, admin_token, db_session):
+    headers = {"Authorization":f"Bearer {admin_token}"}
+    dummy_redis = app.dependency_overrides[get_redis]()
+
+    # first read fills the cache: Milk 100 / 50 per Breakfast
+    r = await client.get("/portion-estimates", headers=headers)
+    assert next(x for x in r.json() if x["meal_id"] == 1)["portions"] == 2
+    assert PORTION_ESTIMATES_CACHE_KEY in dummy_redis.store
+
+    # a change behind the API's back is not seen: the page comes from the cache
+    milk = await db_session.get(Product, 1)
+    milk.quantity = 150.0
+    await db_session.commit()
+    r = await client.get("/portion-estimates", headers=headers)
+    assert next(x for x in r.json() if x["meal_id"] == 1)["portions"] == 2
+
+    # a write through the API clears it
+    r = await client.put(
+        "/products/1",
+        json={"name":"Milk","quantity":200.0,"threshold":10.0},
+        headers=headers
+    )
+    assert r.status_code == 200
+    assert PORTION_ESTIMATES_CACHE_KEY not in dummy_redis.store
+    r = await client.get("/portion-estimates", headers=headers)
+    assert next(x for x in r.json() if x["meal_id"] == 1)["portions"] == 4
+
+async def test_inventory_survives_redis_outage(client, admin_token, monkeypatch):
+    class BrokenRedis:
+        async def get(self, key): raise RedisConnectionError("redis is down")
+        async def hget(self, key, field): raise RedisConnectionError("redis is down")
+        async def set(self, key, value, ex=None): raise RedisConnectionError("redis is down")
+        async def delete(self, *keys): raise RedisConnectionError("redis is down")
+        def pipeline(self, transaction=True): raise RedisConnectionError("redis is down")
+    monkeypatch.setitem(app.dependency_overrides, get_redis, lambda: BrokenRedis())
+    headers = {"Authorization":f"Bearer {admin_token}"}
+
+    # the committed write is still reported as a success
+    r = await client.put(
+        "/products/1",
+        json={"name":"Milk","quantity":200.0,"threshold":10.0},
+        headers=headers
+    )
+    assert r.status_code == 200
+
+    # reads fall back to the database
+    r = await client.get("/portion-estimates", headers=headers)
+    assert r.status_code == 200
+    assert next(x for x in r.json() if x["meal_id"] == 1)["portions"] == 4
+    r = await client.get("/notifications", headers=headers)
+    assert r.status_code == 200
+
 async def test_generate_and_fetch_report_endpoints(client, admin_token):
     # trigger generation
     r = await client.post(
@@ -223,10 +212,9 @@ async def test_generate_and_fetch_report_endpoints(client, admin_token):
     assert js["status"] == "SUCCESS"
     assert "result" in js
 
-@pytest.mark.asyncio
 async def test_notifications_and_discrepancy_endpoints(client, admin_token, db_session):
     # ensure low inventory
-    low = Product(name="LowProd", quantity=1, threshold=5, delivery_date=datetime.now())
+    low = Product(name="LowProd", quantity=1, threshold=5)
     db_session.add(low)
     await db_session.commit()
 
@@ -245,7 +233,6 @@ async def test_notifications_and_discrepancy_endpoints(client, admin_token, db_s
     assert js["status"] == "SUCCESS"
     assert "result" in js
 
-@pytest.mark.asyncio
 async def test_usage_report_date_filtering(client, admin_token, db_session):
     # old log
     old = InventoryLog(
@@ -263,7 +250,6 @@ async def test_usage_report_date_filtering(client, admin_token, db_session):
     assert r.status_code == 200
     assert r.json()["usage"] == {}
 
-@pytest.mark.asyncio
 async def test_servings_log(client, admin_token, db_session):
     # add serving
     sv = MealServing(meal_id=1, user_id=1)
@@ -277,16 +263,15 @@ async def test_servings_log(client, admin_token, db_session):
     assert r.status_code == 200
     assert isinstance(r.json(), list)
 
-@pytest.mark.asyncio
 async def test_websocket_inventory_endpoints(client, cook_token, admin_token):
     from starlette.testclient import TestClient
+    from starlette.websockets import WebSocketDisconnect
 
-    # cook is not authorized → handshake still succeeds but server immediately closes.
+    # cook is not authorized → the server closes before accepting; fails fast, no timeout
     with TestClient(app) as tc:
-        ws = tc.websocket_connect(f"/ws/inventory?token={cook_token}", timeout=1)
-        # as soon as we try to receive, it will have been closed:
-        with pytest.raises(Exception):
-            ws.receive_json()
+        with pytest.raises(WebSocketDisconnect):
+            with tc.websocket_connect(f"/ws/inventory?token={cook_token}") as ws:
+                ws.receive_json()
 
     # admin *is* authorized → we can open the socket and then close cleanly
     with TestClient(app) as tc:
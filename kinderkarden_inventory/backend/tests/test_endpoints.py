@@ -1,19 +1,29 @@
 import pytest
+import pytest_asyncio
 from httpx import AsyncClient
-import asyncio
-import websockets
-from app.schemas import ProductCreate, MealCreate, MealServingCreate
+import uuid
+from starlette.websockets import WebSocketDisconnect
+from app import tasks
 from app.models import Product, Meal, MealIngredient, MealServing, InventoryLog
 from datetime import datetime, timedelta
+from sqlalchemy import select
 from celery.result import AsyncResult
-import json
 
-@pytest.mark.asyncio
+# Log and serving rows for the report tests, added in one commit
+@pytest_asyncio.fixture
+async def seed_logs(db_session):
+    now = datetime.now()
+    db_session.add_all([
+        InventoryLog(product_id=1, change_type="delivery", quantity=10.0, user_id=1, timestamp=now),
+        InventoryLog(product_id=1, change_type="consumption", quantity=10.0, user_id=1, timestamp=now),
+        MealServing(meal_id=1, user_id=1, timestamp=now),
+    ])
+    await db_session.commit()
+
 async def test_register(client):
     response = await client.post("/register", json={"username": "testuser", "password": "testpass123", "role": "manager"})
     assert response.status_code == 200
-    assert response.json()["message"] == "User registered successfully"
-    assert response.json()["role"] == "manager"
+    assert response.json() == {"username": "testuser", "role": "manager"}
 
     response = await client.post("/register", json={"username": "testuser", "password": "testpass123", "role": "manager"})
     assert response.status_code == 400
@@ -21,10 +31,10 @@ async def test_register(client):
 
     response = await client.post("/register", json={"username": "testuser2", "password": "pass", "role": "invalid"})
     assert response.status_code == 422
+
     response = await client.post("/register", json={"username": "testuser3", "password": "testpass", "role": "cook"})
     assert response.status_code == 200
 
-@pytest.mark.asyncio
 async def test_login(client, db_session):
     response = await client.post("/login", data={"username": "adminuser", "password": "adminpass"})
     assert response.status_code == 200
@@ -34,114 +44,126 @@ async def test_login(client, db_session):
     assert response.status_code == 401
     assert response.json()["detail"] == "Incorrect username or password"
 
-@pytest.mark.asyncio
 async def test_refresh_token(client, admin_token):
     response = await client.post("/refresh", headers={"Authorization": f"Bearer {admin_token}"})
     assert response.status_code == 200
     assert "access_token" in response.json()
     assert response.json()["expires_in"] == 1800
 
-@pytest.mark.asyncio
-async def test_products_endpoints(client, admin_token, cook_token, db_session):
-    response = await client.get("/products?skip=0&limit=10", headers={"Authorization": f"Bearer {admin_token}"})
-    print(f"GET /products response: {response.json()}")
+async def test_products_crud(client, admin_token, db_session):
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    response = await client.get("/products?skip=0&limit=10", headers=headers)
     assert response.status_code == 200
     assert isinstance(response.json(), list)
 
-    response = await client.post("/products", json={"name": "Bread", "quantity": -1.0, "threshold": 5.0}, headers={"Authorization": f"Bearer {admin_token}"})
-    print(f"POST /products (invalid) response: {response.json()}")
+    response = await client.post("/products", json={"name": "Bread", "quantity": -1.0, "threshold": 5.0}, headers=headers)
     assert response.status_code == 422
+
     product_data = {"name": "Bread", "quantity": 50.0, "threshold": 5.0}
-    response = await client.post("/products", json=product_data, headers={"Authorization": f"Bearer {admin_token}"})
-    print(f"POST /products response: {response.json()}")
+    response = await client.post("/products", json=product_data, headers=headers)
     assert response.status_code == 200
     product_id = response.json()["id"]
     assert response.json()["name"] == "Bread"
 
-    response = await client.get(f"/products/{product_id}", headers={"Authorization": f"Bearer {admin_token}"})
-    print(f"GET /products/{product_id} response: {response.json()}")
+    response = await client.get(f"/products/{product_id}", headers=headers)
     assert response.status_code == 200
     updated_data = {"name": "Bread Updated", "quantity": 60.0, "threshold": 6.0}
-    response = await client.put(f"/products/{product_id}", json=updated_data, headers={"Authorization": f"Bearer {admin_token}"})
-    print(f"PUT /products/{product_id} response: {response.json()}")
+    response = await client.put(f"/products/{product_id}", json=updated_data, headers=headers)
     assert response.status_code == 200
     assert response.json()["quantity"] == 60.0
-    response = await client.delete(f"/products/{product_id}", headers={"Authorization": f"Bearer {admin_token}"})
-    print(f"DELETE /products/{product_id} response: {response.json()}")
+    response = await client.delete(f"/products/{product_id}", headers=headers)
     assert response.status_code == 200
     assert response.json()["message"] == "Product deleted"
 
+async def test_delete_product_keeps_logs(client, admin_token, db_session):
+    # conftest enables PRAGMA foreign_keys, so this runs against the FK as on Postgres
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    response = await client.post("/products", json={"name": f"Eggs_{uuid.uuid4().hex[:8]}", "quantity": 12.0, "threshold": 2.0}, headers=headers)
+    assert response.status_code == 200
+    product_id = response.json()["id"]
+
+    response = await client.delete(f"/products/{product_id}", headers=headers)
+    assert response.status_code == 200
+    assert await db_session.get(Product, product_id) is None
+
+    # The delivery and removal logs survive, detached from the deleted product
+    result = await db_session.execute(
+        select(InventoryLog.change_type, InventoryLog.product_id)
+        .where(InventoryLog.change_type.in_(["delivery", "removal"]), InventoryLog.quantity == 12.0)
+    )
+    assert sorted(result.all()) == [("delivery", None), ("removal", None)]
+
+    response = await client.delete(f"/products/{product_id}", headers=headers)
+    assert response.status_code == 404
+
+async def test_products_unauthorized(client, cook_token):
     response = await client.get("/products", headers={"Authorization": f"Bearer {cook_token}"})
-    print(f"GET /products (unauthorized) response: {response.json()}")
     assert response.status_code == 403
 
-@pytest.mark.asyncio
 async def test_meals_endpoints(client, admin_token, cook_token, db_session):
     response = await client.get("/meals?skip=0&limit=10", headers={"Authorization": f"Bearer {admin_token}"})
-    print(f"GET /meals response: {response.json()}")
     assert response.status_code == 200
     assert isinstance(response.json(), list)
 
-    unique_meal_name = f"Lunch_{int(datetime.now().timestamp())}"
+    unique_meal_name = f"Lunch_{uuid.uuid4().hex[:8]}"
     meal_data = {"name": unique_meal_name, "ingredients": [{"meal_id": 1, "product_id": 1, "quantity": 30.0}]}
     response = await client.post("/meals", json=meal_data, headers={"Authorization": f"Bearer {admin_token}"})
     assert response.status_code == 200
     assert response.json()["name"] == unique_meal_name
 
-    response = await client.get("/meals?skip=0&limit=10", headers={"Authorization": f"Bearer {admin_token}"})
-    assert response.status_code == 200
-
-@pytest.mark.asyncio
 async def test_serve_meal(client, admin_token, cook_token, db_session):
-    meal_serving = MealServingCreate(meal_id=1)
-    response = await client.post("/serve-meal", json=meal_serving.dict(), headers={"Authorization": f"Bearer {cook_token}"})
-    print(f"POST /serve-meal response: {response.json()}")
+    response = await client.post("/serve-meal", json={"meal_id": 1}, headers={"Authorization": f"Bearer {cook_token}"})
     assert response.status_code == 200
     assert response.json()["meal_id"] == 1
-    product = await db_session.execute(select(Product).filter(Product.id == 1))
-    product = product.scalars().first()
-    print(f"Product quantity after serving: {product.quantity}")
+    product = await db_session.get(Product, 1)
     assert product.quantity == 50.0  # 100 - 50
 
-    response = await client.post("/serve-meal", json=meal_serving.dict(), headers={"Authorization": f"Bearer {cook_token}"})
-    print(f"POST /serve-meal (insufficient) response: {response.json()}")
+    # The second serving uses up the rest; only a third runs short
+    response = await client.post("/serve-meal", json={"meal_id": 1}, headers={"Authorization": f"Bearer {cook_token}"})
+    assert response.status_code == 200
+
+    response = await client.post("/serve-meal", json={"meal_id": 1}, headers={"Authorization": f"Bearer {cook_token}"})
     assert response.status_code == 400
     assert "Insufficient quantity" in response.json()["detail"]
 
-    response = await client.post("/serve-meal", json=meal_serving.dict(), headers={"Authorization": f"Bearer {admin_token}"})
-    print(f"POST /serve-meal (unauthorized) response: {response.json()}")
+    response = await client.post("/serve-meal", json={"meal_id": 1}, headers={"Authorization": f"Bearer {admin_token}"})
     assert response.status_code == 403
 
-@pytest.mark.asyncio
 async def test_portion_estimates(client, admin_token):
     response = await client.get("/portion-estimates", headers={"Authorization": f"Bearer {admin_token}"})
     assert response.status_code == 200
     assert isinstance(response.json(), list)
     assert any(m["meal_id"] == 1 for m in response.json())
 
-@pytest.mark.asyncio
-async def test_generate_report(client, admin_token, db_session):
-    log = InventoryLog(product_id=1, change_type="delivery", quantity=10.0, user_id=1, timestamp=datetime.now())
-    db_session.add(log)
-    await db_session.commit()
+async def test_generate_report(client, admin_token, seed_logs):
 
     response = await client.post("/generate-report", headers={"Authorization": f"Bearer {admin_token}"})
-    print(f"POST /generate-report response: {response.json()}")
     assert response.status_code == 200
     task_id = response.json()["task_id"]
     assert task_id
 
-    for _ in range(40):
-        response = await client.get(f"/report/{task_id}", headers={"Authorization": f"Bearer {admin_token}"})
-        print(f"Polling status for task {task_id}: {response.json()}")
-        if response.json()["status"] == "completed":
-            break
-        await asyncio.sleep(1)
+    # Eager Celery has already finished the task
+    response = await client.get(f"/report/{task_id}", headers={"Authorization": f"Bearer {admin_token}"})
     assert response.status_code == 200
-    assert response.json()["status"] == "completed"
+    assert response.json()["status"] == "SUCCESS"
     assert "report" in response.json()["result"]
 
-@pytest.mark.asyncio
+async def test_generate_report_without_discrepancy(client, admin_token, seed_logs, monkeypatch):
+    # A failing discrepancy calculation must not take the monthly report down with it
+    def broken(conn):
+        raise RuntimeError("portion_estimates_mv is missing")
+    monkeypatch.setattr(tasks, "get_total_potential_portions", broken)
+
+    response = await client.post("/generate-report", headers={"Authorization": f"Bearer {admin_token}"})
+    assert response.status_code == 200
+    task_id = response.json()["task_id"]
+
+    response = await client.get(f"/report/{task_id}", headers={"Authorization": f"Bearer {admin_token}"})
+    assert response.status_code == 200
+    assert response.json()["status"] == "SUCCESS"
+    assert "report" in response.json()["result"]
+    assert "error" in response.json()["result"]["discrepancy"]
+
 async def test_notifications(client, admin_token, db_session):
     response = await client.get("/notifications", headers={"Authorization": f"Bearer {admin_token}"})
     assert response.status_code == 200
@@ -149,20 +171,12 @@ async def test_notifications(client, admin_token, db_session):
     task_id = response.json()["discrepancy_task_id"]
     assert task_id
 
-    for _ in range(20):
-        response = await client.get(f"/discrepancy/{task_id}", headers={"Authorization": f"Bearer {admin_token}"})
-        if response.json()["status"] == "completed":
-            break
-        await asyncio.sleep(1)
+    response = await client.get(f"/discrepancy/{task_id}", headers={"Authorization": f"Bearer {admin_token}"})
     assert response.status_code == 200
-    assert response.json()["status"] == "completed"
+    assert response.json()["status"] == "SUCCESS"
     assert "discrepancy_rate" in response.json()["result"]
 
-@pytest.mark.asyncio
-async def test_usage_report(client, admin_token, db_session):
-    log = InventoryLog(product_id=1, change_type="consumption", quantity=10.0, user_id=1, timestamp=datetime.now())
-    db_session.add(log)
-    await db_session.commit()
+async def test_usage_report(client, admin_token, seed_logs):
 
     response = await client.get("/usage-report", headers={"Authorization": f"Bearer {admin_token}"})
     assert response.status_code == 200
@@ -171,11 +185,7 @@ async def test_usage_report(client, admin_token, db_session):
     response = await client.get("/usage-report?start_date=2025-05-01&end_date=2025-05-24", headers={"Authorization": f"Bearer {admin_token}"})
     assert response.status_code == 200
 
-@pytest.mark.asyncio
-async def test_servings_log(client, admin_token, db_session):
-    serving = MealServing(meal_id=1, user_id=1, timestamp=datetime.now())
-    db_session.add(serving)
-    await db_session.commit()
+async def test_servings_log(client, admin_token, seed_logs):
 
     response = await client.get("/servings-log?skip=0&limit=10", headers={"Authorization": f"Bearer {admin_token}"})
     assert response.status_code == 200
@@ -184,26 +194,17 @@ async def test_servings_log(client, admin_token, db_session):
     response = await client.get("/servings-log?start_date=2025-05-01&end_date=2025-05-24", headers={"Authorization": f"Bearer {admin_token}"})
     assert response.status_code == 200
 
-@pytest.mark.asyncio
-async def test_websocket_inventory(client, cook_token, db_session):
-    uri = f"ws://localhost:8000/ws/inventory?token={cook_token}"
-    async with websockets.connect(uri) as websocket:
-        meal_serving = MealServingCreate(meal_id=1)
-        response = await client.post("/serve-meal", json=meal_serving.dict(), headers={"Authorization": f"Bearer {cook_token}"})
-        print(f"POST /serve-meal response: {response.json()}")
+async def test_websocket_inventory(client, ws_client, admin_token, cook_token):
+    # In-process ASGI websocket; no uvicorn server or TCP socket needed
+    with ws_client.websocket_connect(f"/ws/inventory?token={admin_token}") as websocket:
+        response = await client.post("/serve-meal", json={"meal_id": 1}, headers={"Authorization": f"Bearer {cook_token}"})
         assert response.status_code == 200
 
-        message = await websocket.recv()
-        data = json.loads(message)
-        print(f"WebSocket message: {data}")
+        data = websocket.receive_json()
         assert data["channel"] == "inventory_updates"
         assert "Inventory updated" in data["data"]
 
     # Test unauthorized access
-    uri_invalid = f"ws://localhost:8000/ws/inventory?token=invalid_token"
-    try:
-        async with websockets.connect(uri_invalid) as websocket:
-            await asyncio.wait_for(websocket.recv(), timeout=1.0)
-            pytest.fail("Expected connection to close due to invalid token")
-    except websockets.exceptions.ConnectionClosed:
-        pass
\ No newline at end of file
+    with pytest.raises(WebSocketDisconnect):
+        with ws_client.websocket_connect("/ws/inventory?token=invalid_token") as websocket:
+            websocket.receive_text()